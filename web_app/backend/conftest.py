@@ -0,0 +1,75 @@
+import datetime
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+# The backend uses package-relative imports, so tests import it as `backend.*`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClientError(Exception):
+    """Mimics botocore's ClientError without requiring botocore."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    """In-memory stand-in for the subset of the boto3 S3 client we use."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def _put(self, key, data):
+        self.objects[key] = {
+            "data": data,
+            "etag": hashlib.md5(data).hexdigest(),
+            "modified": datetime.datetime.now(datetime.timezone.utc),
+        }
+
+    def _get(self, key):
+        if key not in self.objects:
+            raise FakeClientError("NoSuchKey")
+        return self.objects[key]
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise FakeClientError("404")
+        obj = self.objects[Key]
+        return {"ContentLength": len(obj["data"]), "LastModified": obj["modified"], "ETag": obj["etag"]}
+
+    def get_object(self, Bucket, Key):
+        obj = self._get(Key)
+        return {"Body": io.BytesIO(obj["data"]), "ContentLength": len(obj["data"])}
+
+    def put_object(self, Bucket, Key, Body):
+        self._put(Key, Body)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key):
+        self._put(Key, Fileobj.read())
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix, Delimiter):
+                contents = [
+                    {"Key": key, "Size": len(obj["data"]), "LastModified": obj["modified"], "ETag": obj["etag"]}
+                    for key, obj in sorted(objects.items())
+                    if key.startswith(Prefix) and Delimiter not in key[len(Prefix):]
+                ]
+                # Two pages to exercise pagination
+                yield {"Contents": contents[:1]}
+                yield {"Contents": contents[1:]}
+
+        return Paginator()
+
+
+@pytest.fixture
+def s3_client():
+    return FakeS3Client()
@@ -1,9 +1,10 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
 import os
+import re
 import shutil
+import asyncio
 import logging
 import psutil
 import subprocess
@@ -13,11 +14,26 @@ except ImportError:
     GPUtil = None
 from typing import List
 from .services.process_manager import process_manager
+from .services.storage import storage, workspace, sync, run_blocking
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Storage paths, relative to sd-scripts/ (or the bucket prefix for S3 storage).
+# Datasets and checkpoints go through `storage`; the training config is always
+# read and written on the local `workspace`, since that is what train.sh uses.
+DATASET_DIR = "workspace/datasets/goal"
+OUTPUT_DIR = "workspace/output/chroma_loras"
+TRAIN_SH_PATH = "train.sh"
+TOML_PATH = "workspace/lora_config.toml"
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# Held from the "already running?" check until the process has started, so the
+# dataset pull before training cannot race another start request
+process_start_lock = asyncio.Lock()
+
 app = FastAPI()
 
 # CORS configuration
@@ -42,51 +58,66 @@ async def websocket_endpoint(websocket: WebSocket):
 
 @app.post("/api/start-setup")
 async def start_setup():
-    if process_manager.running:
-        return {"status": "error", "message": "Process already running"}
+    async with process_start_lock:
+        if process_manager.running:
+            return {"status": "error", "message": "Process already running"}
     
-    cmd = "bash setup.sh" 
+        cmd = "bash setup.sh" 
     
-    try:
-        await process_manager.start_process(cmd, cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-        return {"status": "success", "message": "Setup started"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        try:
+            await process_manager.start_process(cmd, cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+            return {"status": "success", "message": "Setup started"}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
 
 @app.post("/api/upload-dataset")
 async def upload_dataset(files: List[UploadFile] = File(...)):
-    # Define dataset directory: chroma-trainer/sd-scripts/workspace/datasets/goal
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    dataset_dir = os.path.join(root_dir, "sd-scripts", "workspace", "datasets", "goal")
-    
-    if not os.path.exists(dataset_dir):
-        os.makedirs(dataset_dir, exist_ok=True)
-    
+    # Plain file names only: no sub-directories inside the dataset
+    for file in files:
+        if not file.filename or "/" in file.filename or "\\" in file.filename or file.filename in (".", ".."):
+            return {"status": "error", "message": f"Invalid file name: {file.filename}", "files": []}
+
     uploaded_files = []
     try:
         for file in files:
-            file_path = os.path.join(dataset_dir, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            await storage.write_fileobj(f"{DATASET_DIR}/{file.filename}", file.file)
             uploaded_files.append(file.filename)
             
-        return {"status": "success", "message": f"Uploaded {len(uploaded_files)} files to {dataset_dir}", "files": uploaded_files}
+        return {"status": "success", "message": f"Uploaded {len(uploaded_files)} files to {storage.location(DATASET_DIR)}", "files": uploaded_files}
     except Exception as e:
         logger.error(f"Upload failed: {e}")
-        return {"status": "error", "message": str(e)}
+        return {"status": "error", "message": str(e), "files": uploaded_files}
+
+async def push_outputs():
+    pushed = await sync(workspace, storage, OUTPUT_DIR)
+    logger.info(f"Pushed {len(pushed)} checkpoints to {storage.location(OUTPUT_DIR)}")
+    await process_manager.broadcast(f"\n[Uploaded {len(pushed)} checkpoints to {storage.location(OUTPUT_DIR)}]\n")
 
 @app.post("/api/start-training")
 async def start_training():
-    if process_manager.running:
-        return {"status": "error", "message": "Process already running"}
+    async with process_start_lock:
+        if process_manager.running:
+            return {"status": "error", "message": "Process already running"}
     
-    cmd = "cd sd-scripts && bash train.sh"
+        cmd = "cd sd-scripts && bash train.sh"
+
+        on_exit = None
+        if storage is not workspace:
+            # Remote storage: train.sh only sees the local workspace, so pull the
+            # dataset down first and push the checkpoints back once the run ends
+            try:
+                pulled = await sync(storage, workspace, DATASET_DIR)
+                logger.info(f"Pulled {len(pulled)} dataset files from {storage.location(DATASET_DIR)}")
+            except Exception as e:
+                logger.error(f"Dataset sync failed: {e}")
+                return {"status": "error", "message": f"Dataset sync failed: {e}"}
+            on_exit = push_outputs
     
-    try:
-        await process_manager.start_process(cmd, cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-        return {"status": "success", "message": "Training started"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        try:
+            await process_manager.start_process(cmd, cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), on_exit=on_exit)
+            return {"status": "success", "message": "Training started"}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
 
 @app.post("/api/stop-training")
 async def stop_training():
@@ -104,7 +135,7 @@ async def get_status():
     root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     venv_path = os.path.join(root_dir, "venv")
     
-    is_installed = os.path.exists(venv_path)
+    is_installed = await run_blocking(os.path.exists, venv_path)
     
     return {
         "running": process_manager.running,
@@ -169,12 +200,52 @@ async def get_system_stats():
         "gpu": gpu_data
     }
 
+TRAIN_SH_FIELDS = {
+    "output_name": str,
+    "network_dim": int,
+    "network_alpha": float,
+    "max_train_steps": int,
+    "save_every_n_steps": int,
+    "learning_rate": float,
+}
+TRAIN_SH_PATTERNS = {key: re.compile(rf'--{key}[=\s]+"?([^"\s\\]+)"?') for key in TRAIN_SH_FIELDS}
+TOML_RESOLUTION_PATTERN = re.compile(r'resolution\s*=\s*\[\s*(\d+)')
+TOML_NUM_REPEATS_PATTERN = re.compile(r'num_repeats\s*=\s*(\d+)')
+
+# Patterns used to rewrite the config files in update_training_config
+TRAIN_SH_REPLACE_PATTERNS = {
+    key: re.compile(rf'(--{key}[=\s]+"?)([^"\s\\]+)("?)')
+    for key in (*TRAIN_SH_FIELDS, "max_bucket_reso")
+}
+MAX_BUCKET_RESO_PATTERN = re.compile(r'--max_bucket_reso[=\s]+"?(\d+)"?')
+TOML_RESOLUTION_REPLACE_PATTERN = re.compile(r'(resolution\s*=\s*\[\s*)(\d+)(\s*,\s*)(\d+)(\s*\])')
+TOML_NUM_REPEATS_REPLACE_PATTERN = re.compile(r'(num_repeats\s*=\s*)(\d+)')
+
+def parse_train_sh(content: str) -> dict:
+    # Only the keys present in the script; parsed once per file version via workspace.load
+    values = {}
+    for key, cast in TRAIN_SH_FIELDS.items():
+        match = TRAIN_SH_PATTERNS[key].search(content)
+        if match:
+            values[key] = cast(match.group(1))
+    return values
+
+def parse_lora_toml(content: str) -> dict:
+    values = {}
+    # Extract resolution = [512, 512] -> just take the first number
+    # Allow for spaces: resolution = [ 512 , 512 ]
+    res_match = TOML_RESOLUTION_PATTERN.search(content)
+    if res_match:
+        values["resolution"] = int(res_match.group(1))
+
+    # Extract num_repeats = 10
+    rep_match = TOML_NUM_REPEATS_PATTERN.search(content)
+    if rep_match:
+        values["num_repeats"] = int(rep_match.group(1))
+    return values
+
 @app.get("/api/training-config")
 async def get_training_config():
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    train_sh_path = os.path.join(root_dir, "sd-scripts", "train.sh")
-    toml_path = os.path.join(root_dir, "sd-scripts", "workspace", "lora_config.toml")
-    
     config = {
         "output_name": "chroma_lora",
         "network_dim": 16,
@@ -186,44 +257,16 @@ async def get_training_config():
         "num_repeats": 10
     }
     
-    import re
+    try:
+        config.update(await workspace.load(TRAIN_SH_PATH, parse_train_sh) or {})
+    except Exception as e:
+        logger.error(f"Error reading train.sh: {e}")
 
-    if os.path.exists(train_sh_path):
-        try:
-            with open(train_sh_path, "r") as f:
-                content = f.read()
-                
-                def extract(key, default):
-                    match = re.search(rf'--{key}[=\s]+"?([^"\s\\]+)"?', content)
-                    return match.group(1) if match else default
-
-                config["output_name"] = extract("output_name", config["output_name"])
-                config["network_dim"] = int(extract("network_dim", config["network_dim"]))
-                config["network_alpha"] = float(extract("network_alpha", config["network_alpha"]))
-                config["max_train_steps"] = int(extract("max_train_steps", config["max_train_steps"]))
-                config["save_every_n_steps"] = int(extract("save_every_n_steps", config["save_every_n_steps"]))
-                config["learning_rate"] = float(extract("learning_rate", config["learning_rate"]))
-        except Exception as e:
-            logger.error(f"Error reading train.sh: {e}")
+    try:
+        config.update(await workspace.load(TOML_PATH, parse_lora_toml) or {})
+    except Exception as e:
+        logger.error(f"Error reading lora_config.toml: {e}")
 
-    if os.path.exists(toml_path):
-        try:
-            with open(toml_path, "r") as f:
-                content = f.read()
-                
-                # Extract resolution = [512, 512] -> just take the first number
-                # Allow for spaces: resolution = [ 512 , 512 ]
-                res_match = re.search(r'resolution\s*=\s*\[\s*(\d+)', content)
-                if res_match:
-                    config["resolution"] = int(res_match.group(1))
-                
-                # Extract num_repeats = 10
-                rep_match = re.search(r'num_repeats\s*=\s*(\d+)', content)
-                if rep_match:
-                    config["num_repeats"] = int(rep_match.group(1))
-        except Exception as e:
-            logger.error(f"Error reading lora_config.toml: {e}")
-            
     return config
 
 from pydantic import BaseModel
@@ -240,27 +283,18 @@ class TrainingConfig(BaseModel):
 
 @app.post("/api/training-config")
 async def update_training_config(config: TrainingConfig):
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    train_sh_path = os.path.join(root_dir, "sd-scripts", "train.sh")
-    toml_path = os.path.join(root_dir, "sd-scripts", "workspace", "lora_config.toml")
-    
-    if not os.path.exists(train_sh_path):
-        return {"status": "error", "message": "train.sh not found"}
-        
     try:
-        import re
-        
         # Update train.sh
-        with open(train_sh_path, "r") as f:
-            content = f.read()
-            
+        content = await workspace.load(TRAIN_SH_PATH)
+        if content is None:
+            return {"status": "error", "message": "train.sh not found"}
+
         def replace(key, value, text):
-            pattern = rf'(--{key}[=\s]+"?)([^"\s\\]+)("?)'
             def replacer(match):
                 prefix = match.group(1)
                 suffix = match.group(3)
                 return f"{prefix}{value}{suffix}"
-            return re.sub(pattern, replacer, text)
+            return TRAIN_SH_REPLACE_PATTERNS[key].sub(replacer, text)
 
         content = replace("output_name", config.output_name, content)
         content = replace("network_dim", str(config.network_dim), content)
@@ -275,7 +309,7 @@ async def update_training_config(config: TrainingConfig):
         # So we should update max_bucket_reso to be at least config.resolution
         
         # Find current max_bucket_reso
-        max_bucket_match = re.search(r'--max_bucket_reso[=\s]+"?(\d+)"?', content)
+        max_bucket_match = MAX_BUCKET_RESO_PATTERN.search(content)
         if max_bucket_match:
             current_max_bucket = int(max_bucket_match.group(1))
             if config.resolution > current_max_bucket:
@@ -296,27 +330,23 @@ async def update_training_config(config: TrainingConfig):
         target_bucket_reso = max(768, config.resolution)
         content = replace("max_bucket_reso", str(target_bucket_reso), content)
         
-        with open(train_sh_path, "w") as f:
-            f.write(content)
+        await workspace.write_text(TRAIN_SH_PATH, content)
 
         # Update lora_config.toml
-        if os.path.exists(toml_path):
-            with open(toml_path, "r") as f:
-                toml_content = f.read()
-            
+        toml_content = await workspace.load(TOML_PATH)
+        if toml_content is not None:
             # Replace resolution = [512, 512]
             # Robust regex to handle spaces
-            toml_content = re.sub(r'(resolution\s*=\s*\[\s*)(\d+)(\s*,\s*)(\d+)(\s*\])', 
-                                  f"\\g<1>{config.resolution}\\g<3>{config.resolution}\\g<5>", 
-                                  toml_content)
+            toml_content = TOML_RESOLUTION_REPLACE_PATTERN.sub(
+                f"\\g<1>{config.resolution}\\g<3>{config.resolution}\\g<5>",
+                toml_content)
             
             # Replace num_repeats = 10
-            toml_content = re.sub(r'(num_repeats\s*=\s*)(\d+)', 
-                                  f"\\g<1>{config.num_repeats}", 
-                                  toml_content)
-                                  
-            with open(toml_path, "w") as f:
-                f.write(toml_content)
+            toml_content = TOML_NUM_REPEATS_REPLACE_PATTERN.sub(
+                f"\\g<1>{config.num_repeats}",
+                toml_content)
+
+            await workspace.write_text(TOML_PATH, toml_content)
             
         return {"status": "success", "message": "Configuration updated"}
     except Exception as e:
@@ -325,21 +355,13 @@ async def update_training_config(config: TrainingConfig):
 
 @app.get("/api/outputs")
 async def list_outputs():
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    output_dir = os.path.join(root_dir, "sd-scripts", "workspace", "output", "chroma_loras")
-    
-    if not os.path.exists(output_dir):
-        return {"files": []}
-        
     files = []
-    for f in os.listdir(output_dir):
-        if f.endswith(".safetensors"):
-            file_path = os.path.join(output_dir, f)
-            stats = os.stat(file_path)
+    for entry in await storage.list(OUTPUT_DIR):
+        if entry.name.endswith(".safetensors"):
             files.append({
-                "name": f,
-                "size": stats.st_size,
-                "modified": stats.st_mtime
+                "name": entry.name,
+                "size": entry.size,
+                "modified": entry.modified
             })
             
     # Sort by modified time (newest first)
@@ -348,42 +370,36 @@ async def list_outputs():
 
 @app.get("/api/download/{filename}")
 async def download_output(filename: str):
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    output_dir = os.path.join(root_dir, "sd-scripts", "workspace", "output", "chroma_loras")
-    file_path = os.path.join(output_dir, filename)
+    file_path = f"{OUTPUT_DIR}/{filename}"
     
-    if os.path.exists(file_path):
-        return FileResponse(file_path, filename=filename)
+    if await storage.exists(file_path):
+        return await storage.response(file_path, filename=filename)
     return {"error": "File not found"}
 
 # Dataset Management Endpoints
 
 @app.get("/api/dataset")
 async def get_dataset():
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    dataset_dir = os.path.join(root_dir, "sd-scripts", "workspace", "datasets", "goal")
-    
-    if not os.path.exists(dataset_dir):
-        return []
-        
+    entries = await storage.list(DATASET_DIR)
+    names = {entry.name for entry in entries}
+    images = [name for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+    async def read_caption(txt_name):
+        if txt_name not in names:
+            return ""
+        return await storage.read_text(f"{DATASET_DIR}/{txt_name}")
+
+    # Read all captions concurrently instead of one blocking open() per image
+    txt_names = [os.path.splitext(f)[0] + ".txt" for f in images]
+    captions = await asyncio.gather(*(read_caption(txt_name) for txt_name in txt_names))
+
     items = []
-    for f in os.listdir(dataset_dir):
-        if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-            # Found an image
-            image_path = os.path.join(dataset_dir, f)
-            base_name = os.path.splitext(f)[0]
-            txt_path = os.path.join(dataset_dir, base_name + ".txt")
-            
-            caption = ""
-            if os.path.exists(txt_path):
-                with open(txt_path, "r", encoding="utf-8") as txt_file:
-                    caption = txt_file.read()
-            
-            items.append({
-                "name": f,
-                "caption": caption,
-                "has_caption": os.path.exists(txt_path)
-            })
+    for f, txt_name, caption in zip(images, txt_names, captions):
+        items.append({
+            "name": f,
+            "caption": caption,
+            "has_caption": txt_name in names
+        })
     
     # Sort by name
     items.sort(key=lambda x: x["name"])
@@ -391,11 +407,9 @@ async def get_dataset():
 
 @app.get("/api/dataset/image/{filename}")
 async def get_dataset_image(filename: str):
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    dataset_dir = os.path.join(root_dir, "sd-scripts", "workspace", "datasets", "goal")
-    file_path = os.path.join(dataset_dir, filename)
-    if os.path.exists(file_path):
-        return FileResponse(file_path)
+    file_path = f"{DATASET_DIR}/{filename}"
+    if await storage.exists(file_path):
+        return await storage.response(file_path)
     return {"error": "File not found"}
 
 class CaptionUpdate(BaseModel):
@@ -404,16 +418,12 @@ class CaptionUpdate(BaseModel):
 
 @app.post("/api/dataset/caption")
 async def update_caption(data: CaptionUpdate):
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    dataset_dir = os.path.join(root_dir, "sd-scripts", "workspace", "datasets", "goal")
-    
     # Determine txt filename
     base_name = os.path.splitext(data.filename)[0]
-    txt_path = os.path.join(dataset_dir, base_name + ".txt")
+    txt_path = f"{DATASET_DIR}/{base_name}.txt"
     
     try:
-        with open(txt_path, "w", encoding="utf-8") as f:
-            f.write(data.caption)
+        await storage.write_text(txt_path, data.caption)
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Failed to update caption: {e}")
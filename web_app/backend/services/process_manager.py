@@ -15,12 +15,15 @@ class ProcessManager:
         self.slave_fd = None
         self.subscribers = set()
         self.running = False
+        self.on_exit = None
 
-    async def start_process(self, command: str, cwd: str = None):
+    async def start_process(self, command: str, cwd: str = None, on_exit=None):
         if self.running:
             raise Exception("Process already running")
 
         self.running = True
+        # Optional coroutine function awaited once the process has finished
+        self.on_exit = on_exit
         # Create a pseudo-terminal
         self.master_fd, self.slave_fd = pty.openpty()
 
@@ -53,14 +56,20 @@ class ProcessManager:
             raise e
 
     async def _read_output(self):
+        # Everything below belongs to this run only. stop_process() can let a
+        # new run start before this reader finishes, so never touch the shared
+        # state unless it still points at our process.
+        process = self.process
+        master_fd = self.master_fd
+        on_exit = self.on_exit
         try:
-            while self.running and self.process.poll() is None:
+            while process.poll() is None:
                 # Use select to check if data is available to read
-                r, w, e = await asyncio.to_thread(select.select, [self.master_fd], [], [], 0.1)
+                r, w, e = await asyncio.to_thread(select.select, [master_fd], [], [], 0.1)
                 
-                if self.master_fd in r:
+                if master_fd in r:
                     try:
-                        data = os.read(self.master_fd, 1024)
+                        data = os.read(master_fd, 1024)
                         if data:
                             text = data.decode('utf-8', errors='replace')
                             await self.broadcast(text)
@@ -75,14 +84,26 @@ class ProcessManager:
         except Exception as e:
             logger.error(f"Error reading process output: {e}")
         finally:
-            self.running = False
-            await self.broadcast("\n[Process finished]\n")
-            if self.master_fd:
+            try:
+                os.close(master_fd)
+            except OSError:
+                pass
+            if self.process is process:
+                self.master_fd = None
+
+            # `running` stays True while the exit hook runs (e.g. uploading
+            # checkpoints), so no new run can start underneath it
+            if on_exit:
                 try:
-                    os.close(self.master_fd)
-                except:
-                    pass
-            self.master_fd = None
+                    await on_exit()
+                except Exception as e:
+                    logger.error(f"Error in process exit hook: {e}")
+                    await self.broadcast(f"\n[Post-process step failed: {e}]\n")
+
+            if self.process is process:
+                self.on_exit = None
+                self.running = False
+            await self.broadcast("\n[Process finished]\n")
 
     async def subscribe(self, websocket):
         self.subscribers.add(websocket)
@@ -114,7 +135,10 @@ class ProcessManager:
                 except subprocess.TimeoutExpired:
                      os.killpg(os.getpgid(self.process.pid), signal.SIGKILL)
                 
-                self.running = False
+                # With an exit hook pending, the reader clears `running` once
+                # the hook has finished
+                if not self.on_exit:
+                    self.running = False
                 return True
             except Exception as e:
                 logger.error(f"Error stopping process: {e}")
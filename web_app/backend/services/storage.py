@@ -0,0 +1,384 @@
+import asyncio
+import functools
+import mimetypes
+import os
+import posixpath
+import shutil
+import stat
+import tempfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi.responses import FileResponse, StreamingResponse
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+# Dedicated, bounded pool for storage I/O so a slow disk or network mount can
+# neither block the event loop nor starve the default executor.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("STORAGE_IO_WORKERS", "8")),
+    thread_name_prefix="storage-io",
+)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+@dataclass
+class FileInfo:
+    name: str
+    size: int
+    modified: float
+    # Opaque token that changes whenever the content changes (used by the config cache)
+    version: str
+
+
+class Storage(ABC):
+    """Base class for storage backends.
+
+    Paths are relative, '/'-separated keys (e.g. "workspace/datasets/goal/1.png").
+    Subclasses implement the blocking primitives; the public async API runs
+    them on the storage thread pool.
+    """
+
+    def __init__(self):
+        self._cache: Dict[Tuple[str, Optional[Callable]], Tuple[str, Any]] = {}
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        key = posixpath.normpath(path.replace("\\", "/")).lstrip("/")
+        if key == ".." or key.startswith("../"):
+            raise ValueError(f"Invalid path: {path}")
+        return key
+
+    # Blocking primitives
+
+    @abstractmethod
+    def _stat(self, key: str) -> Optional[FileInfo]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _list(self, key: str) -> List[FileInfo]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _read(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _open(self, key: str):
+        """Return a readable binary file object for streaming copies."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def _write(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    @abstractmethod
+    def _write_fileobj(self, key: str, fileobj):
+        raise NotImplementedError
+
+    @abstractmethod
+    def location(self, path: str) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def response(self, path: str, filename: Optional[str] = None):
+        raise NotImplementedError
+
+    # Async API
+
+    async def stat(self, path: str) -> Optional[FileInfo]:
+        return await run_blocking(self._stat, self._normalize(path))
+
+    async def exists(self, path: str) -> bool:
+        return await self.stat(path) is not None
+
+    async def list(self, path: str) -> List[FileInfo]:
+        """List the files directly inside a directory / prefix (non-recursive)."""
+        return await run_blocking(self._list, self._normalize(path))
+
+    async def read_bytes(self, path: str) -> bytes:
+        return await run_blocking(self._read, self._normalize(path))
+
+    async def read_text(self, path: str, encoding: str = "utf-8") -> str:
+        return (await self.read_bytes(path)).decode(encoding)
+
+    async def write_bytes(self, path: str, data: bytes):
+        key = self._normalize(path)
+        await run_blocking(self._write, key, data)
+        self._invalidate(key)
+
+    async def write_text(self, path: str, text: str, encoding: str = "utf-8"):
+        await self.write_bytes(path, text.encode(encoding))
+
+    async def write_fileobj(self, path: str, fileobj):
+        key = self._normalize(path)
+        await run_blocking(self._write_fileobj, key, fileobj)
+        self._invalidate(key)
+
+    async def load(self, path: str, parser: Optional[Callable[[str], Any]] = None):
+        """Read a text file and return parser(text), or the text itself.
+
+        The result is cached per (path, parser) and only recomputed when the
+        file's version changes. Returns None if the file does not exist.
+        """
+        key = self._normalize(path)
+        cache_key = (key, parser)
+        info = await run_blocking(self._stat, key)
+        if info is None:
+            self._cache.pop(cache_key, None)
+            return None
+
+        cached = self._cache.get(cache_key)
+        if cached and cached[0] == info.version:
+            return cached[1]
+
+        text = (await run_blocking(self._read, key)).decode("utf-8")
+        value = parser(text) if parser else text
+        self._cache[cache_key] = (info.version, value)
+        return value
+
+    def _invalidate(self, key: str):
+        for cache_key in [k for k in self._cache if k[0] == key]:
+            del self._cache[cache_key]
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = os.path.abspath(root)
+
+    def _resolve(self, key: str) -> str:
+        # Keys are already normalized (no '..'), so a plain join cannot leave the
+        # root. Symlinks inside it (e.g. workspace/datasets on a larger disk) are
+        # deliberately followed.
+        return os.path.join(self.root, *key.split("/"))
+
+    @staticmethod
+    def _info(name: str, st: os.stat_result) -> FileInfo:
+        return FileInfo(
+            name=name,
+            size=st.st_size,
+            modified=st.st_mtime,
+            version=f"{st.st_ino}-{st.st_mtime_ns}-{st.st_size}",
+        )
+
+    def _stat(self, key):
+        try:
+            st = os.stat(self._resolve(key))
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return self._info(posixpath.basename(key), st)
+
+    def _list(self, key):
+        try:
+            entries = list(os.scandir(self._resolve(key)))
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        return [self._info(e.name, e.stat()) for e in entries if e.is_file()]
+
+    def _read(self, key):
+        with open(self._resolve(key), "rb") as f:
+            return f.read()
+
+    def _open(self, key):
+        return open(self._resolve(key), "rb")
+
+    def _atomic_write(self, key, write):
+        # Write to a temp file in the same directory, then rename over the target
+        # so readers (and the training script) never see a partial file.
+        full_path = self._resolve(key)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(full_path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(full_path):
+                shutil.copymode(full_path, tmp_path)
+            else:
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _write(self, key, data):
+        self._atomic_write(key, lambda f: f.write(data))
+
+    def _write_fileobj(self, key, fileobj):
+        self._atomic_write(key, lambda f: shutil.copyfileobj(fileobj, f, CHUNK_SIZE))
+
+    def location(self, path):
+        return self._resolve(self._normalize(path))
+
+    async def response(self, path, filename=None):
+        # FileResponse already streams the file through a worker thread
+        return FileResponse(self.location(path), filename=filename)
+
+
+class S3Storage(Storage):
+    """S3-compatible object storage (AWS S3, MinIO, R2, ...).
+
+    Object writes are atomic by nature, so no temp-file dance is needed.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, client=None):
+        super().__init__()
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("boto3 is required for the S3 storage backend")
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _stat(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except Exception as e:
+            # Duck-typed so injected non-boto3 clients work too
+            code = (getattr(e, "response", None) or {}).get("Error", {}).get("Code")
+            if code in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return FileInfo(
+            name=posixpath.basename(key),
+            size=head["ContentLength"],
+            modified=head["LastModified"].timestamp(),
+            version=head["ETag"],
+        )
+
+    def _list(self, key):
+        prefix = self._key(key).rstrip("/") + "/"
+        paginator = self.client.get_paginator("list_objects_v2")
+        files = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/"):
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(prefix):]
+                if name:
+                    files.append(FileInfo(
+                        name=name,
+                        size=obj["Size"],
+                        modified=obj["LastModified"].timestamp(),
+                        version=obj["ETag"],
+                    ))
+        return files
+
+    def _read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    def _open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+
+    def _write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def _write_fileobj(self, key, fileobj):
+        self.client.upload_fileobj(fileobj, self.bucket, self._key(key))
+
+    def location(self, path):
+        return f"s3://{self.bucket}/{self._key(self._normalize(path))}"
+
+    async def response(self, path, filename=None):
+        key = self._key(self._normalize(path))
+        obj = await run_blocking(self.client.get_object, Bucket=self.bucket, Key=key)
+        body = obj["Body"]
+
+        async def stream():
+            try:
+                while True:
+                    chunk = await run_blocking(body.read, CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                body.close()
+
+        headers = {"Content-Length": str(obj["ContentLength"])}
+        if filename:
+            # Same encoding as Starlette's FileResponse, so both backends agree
+            quoted = quote(filename)
+            if quoted != filename:
+                headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quoted}"
+            else:
+                headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        media_type = obj.get("ContentType") or mimetypes.guess_type(key)[0] or "application/octet-stream"
+        return StreamingResponse(stream(), media_type=media_type, headers=headers)
+
+
+async def sync(src: Storage, dst: Storage, path: str) -> List[str]:
+    """Copy the files directly inside `path` from src to dst.
+
+    A file is copied when it is missing from dst, has a different size, or is
+    newer in src. Files only present in dst are left alone. Returns the names
+    of the copied files.
+    """
+    key = Storage._normalize(path)
+    src_files = await src.list(key)
+    dst_files = {info.name: info for info in await dst.list(key)}
+
+    async def copy(name):
+        file_key = f"{key}/{name}"
+        fileobj = await run_blocking(src._open, file_key)
+        try:
+            await run_blocking(dst._write_fileobj, file_key, fileobj)
+        finally:
+            fileobj.close()
+        dst._invalidate(file_key)
+
+    copied = []
+    for info in src_files:
+        existing = dst_files.get(info.name)
+        if existing and existing.size == info.size and existing.modified >= info.modified:
+            continue
+        await copy(info.name)
+        copied.append(info.name)
+    return copied
+
+
+def create_storage(workspace: LocalStorage) -> Storage:
+    backend = os.environ.get("STORAGE_BACKEND", "local").lower()
+    if backend == "local":
+        return workspace
+    if backend == "s3":
+        bucket = os.environ.get("S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the S3_BUCKET environment variable")
+        return S3Storage(
+            bucket=bucket,
+            prefix=os.environ.get("S3_PREFIX", ""),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+        )
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {backend!r} (expected 'local' or 's3')")
+
+
+# The local sd-scripts/ tree that train.sh actually runs against. Training
+# config always lives here, whatever the storage backend.
+_root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+workspace = LocalStorage(os.path.join(_root_dir, "sd-scripts"))
+
+# Datasets and checkpoints. Same object as `workspace` unless STORAGE_BACKEND=s3,
+# in which case they are synced to/from the workspace around each training run.
+storage = create_storage(workspace)
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from backend import main
+from backend.services.storage import LocalStorage, S3Storage
+
+
+@pytest.fixture
+def s3_mode(tmp_path, monkeypatch, s3_client):
+    """Run main.py against an in-memory bucket with a fake process manager."""
+    remote = S3Storage("bucket", client=s3_client)
+    local = LocalStorage(str(tmp_path))
+    monkeypatch.setattr(main, "storage", remote)
+    monkeypatch.setattr(main, "workspace", local)
+    monkeypatch.setattr(main, "process_start_lock", asyncio.Lock())
+    monkeypatch.setattr(main.process_manager, "running", False)
+
+    started = []
+
+    async def start_process(command, cwd=None, on_exit=None):
+        if main.process_manager.running:
+            raise Exception("Process already running")
+        main.process_manager.running = True
+        started.append((command, on_exit))
+        return True
+
+    monkeypatch.setattr(main.process_manager, "start_process", start_process)
+    return remote, local, started
+
+
+def test_start_training_pulls_dataset_and_pushes_checkpoints(s3_mode):
+    remote, local, started = s3_mode
+    asyncio.run(remote.write_bytes(f"{main.DATASET_DIR}/a.png", b"img"))
+    asyncio.run(remote.write_text(f"{main.DATASET_DIR}/a.txt", "a caption"))
+
+    result = asyncio.run(main.start_training())
+
+    assert result["status"] == "success"
+    assert asyncio.run(local.read_text(f"{main.DATASET_DIR}/a.txt")) == "a caption"
+    [(command, on_exit)] = started
+    assert command == "cd sd-scripts && bash train.sh"
+    assert on_exit is main.push_outputs
+
+    # Trainer writes a checkpoint locally; the exit hook uploads it
+    asyncio.run(local.write_bytes(f"{main.OUTPUT_DIR}/lora.safetensors", b"weights"))
+    asyncio.run(on_exit())
+    assert asyncio.run(remote.read_bytes(f"{main.OUTPUT_DIR}/lora.safetensors")) == b"weights"
+
+
+def test_concurrent_starts_pull_only_once(s3_mode, monkeypatch):
+    remote, local, started = s3_mode
+    active = []
+    pulls = []
+
+    async def slow_sync(src, dst, path):
+        active.append(path)
+        assert len(active) == 1, "dataset pulls overlapped"
+        pulls.append(path)
+        await asyncio.sleep(0.1)
+        active.remove(path)
+        return []
+
+    monkeypatch.setattr(main, "sync", slow_sync)
+
+    async def scenario():
+        return await asyncio.gather(main.start_training(), main.start_training(), main.start_setup())
+
+    results = asyncio.run(scenario())
+
+    assert [r["status"] for r in results] == ["success", "error", "error"]
+    assert all(r["message"] == "Process already running" for r in results[1:])
+    assert pulls == [main.DATASET_DIR]
+    assert len(started) == 1
+
+
+def test_config_stays_on_local_workspace_in_s3_mode(s3_mode, tmp_path):
+    remote, local, started = s3_mode
+    (tmp_path / "train.sh").write_text('accelerate launch train.py --max_train_steps=3000 --output_name="chroma_lora"\n')
+
+    assert asyncio.run(main.get_training_config())["max_train_steps"] == 3000
+    assert remote.client.objects == {}
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from backend.services.process_manager import ProcessManager
+
+
+async def wait_until(condition, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.02)
+
+
+def test_restart_is_refused_while_exit_hook_runs():
+    async def scenario():
+        manager = ProcessManager()
+        calls = []
+        hook_started = asyncio.Event()
+        release_hook = asyncio.Event()
+
+        async def slow_upload():
+            calls.append("first")
+            hook_started.set()
+            await release_hook.wait()
+
+        async def second_upload():
+            calls.append("second")
+
+        await manager.start_process("sleep 30", on_exit=slow_upload)
+        assert manager.stop_process()
+        await asyncio.wait_for(hook_started.wait(), 5)
+
+        # The first run's upload is still going, so the slot stays taken
+        assert manager.running
+        with pytest.raises(Exception, match="already running"):
+            await manager.start_process("sleep 30", on_exit=second_upload)
+
+        release_hook.set()
+        await wait_until(lambda: not manager.running)
+
+        await manager.start_process("sleep 30", on_exit=second_upload)
+        second = manager.process
+        await asyncio.sleep(0.2)
+        assert manager.running
+        assert manager.master_fd is not None
+        assert manager.on_exit is second_upload
+
+        assert manager.stop_process()
+        await wait_until(lambda: not manager.running)
+        assert second.poll() is not None
+        assert calls == ["first", "second"]
+
+    asyncio.run(scenario())
+
+
+def test_stale_reader_does_not_reset_new_run():
+    async def scenario():
+        manager = ProcessManager()
+
+        await manager.start_process("sleep 30")
+        assert manager.stop_process()
+        assert not manager.running
+
+        # Start again before the first reader has noticed the exit
+        await manager.start_process("sleep 30")
+        second = manager.process
+        await asyncio.sleep(0.5)
+
+        assert manager.running
+        assert manager.process is second
+        assert manager.master_fd is not None
+        assert second.poll() is None
+
+        manager.stop_process()
+        await wait_until(lambda: manager.master_fd is None)
+
+    asyncio.run(scenario())
+
+
+def test_exit_hook_failure_still_frees_the_slot():
+    async def scenario():
+        manager = ProcessManager()
+
+        async def broken_upload():
+            raise RuntimeError("bucket unreachable")
+
+        await manager.start_process("true", on_exit=broken_upload)
+        await wait_until(lambda: not manager.running)
+        assert manager.on_exit is None
+
+    asyncio.run(scenario())
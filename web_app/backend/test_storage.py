@@ -0,0 +1,196 @@
+import asyncio
+import io
+import os
+import stat
+
+import pytest
+
+from backend.services.storage import LocalStorage, S3Storage, Storage, sync
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalStorage(str(tmp_path))
+
+
+@pytest.fixture
+def s3(s3_client):
+    return S3Storage("bucket", prefix="runs/", client=s3_client)
+
+
+def test_incomplete_backend_fails_at_construction():
+    class ReadOnlyStorage(Storage):
+        def _stat(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnlyStorage()
+
+
+# LocalStorage
+
+def test_atomic_write_leaves_no_temp_file_and_keeps_mode(local, tmp_path):
+    script = tmp_path / "train.sh"
+    script.write_text("old")
+    os.chmod(script, 0o755)
+
+    run(local.write_text("train.sh", "new"))
+
+    assert script.read_text() == "new"
+    assert stat.S_IMODE(os.stat(script).st_mode) == 0o755
+    assert os.listdir(tmp_path) == ["train.sh"]
+
+
+def test_failed_write_keeps_original_and_cleans_up(local, tmp_path):
+    (tmp_path / "caption.txt").write_text("original")
+
+    class Broken(io.RawIOBase):
+        def readinto(self, b):
+            raise OSError("disk went away")
+
+    with pytest.raises(OSError):
+        run(local.write_fileobj("caption.txt", Broken()))
+
+    assert (tmp_path / "caption.txt").read_text() == "original"
+    assert os.listdir(tmp_path) == ["caption.txt"]
+
+
+def test_list_and_stat_follow_symlinks_outside_root(tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "a.png").write_bytes(b"img")
+    root = tmp_path / "root"
+    (root / "workspace").mkdir(parents=True)
+    os.symlink(outside, root / "workspace" / "datasets")
+    storage = LocalStorage(str(root))
+
+    assert [f.name for f in run(storage.list("workspace/datasets"))] == ["a.png"]
+    assert run(storage.exists("workspace/datasets/a.png"))
+
+
+def test_rejects_paths_escaping_root(local):
+    with pytest.raises(ValueError):
+        run(local.write_text("workspace/../../evil.txt", "x"))
+
+
+def test_missing_directory_lists_empty(local):
+    assert run(local.list("workspace/output")) == []
+    assert run(local.stat("workspace/output")) is None
+
+
+# Config cache
+
+def test_load_caches_until_file_changes(local, tmp_path):
+    calls = []
+
+    def parser(text):
+        calls.append(text)
+        return {"length": len(text)}
+
+    assert run(local.load("train.sh", parser)) is None
+
+    run(local.write_text("train.sh", "abc"))
+    assert run(local.load("train.sh", parser)) == {"length": 3}
+    assert run(local.load("train.sh", parser)) == {"length": 3}
+    assert calls == ["abc"]
+
+    # Write through the storage layer
+    run(local.write_text("train.sh", "abcd"))
+    assert run(local.load("train.sh", parser)) == {"length": 4}
+    assert calls == ["abc", "abcd"]
+
+    # External edit: only the mtime changes
+    script = tmp_path / "train.sh"
+    script.write_text("wxyz")
+    st = os.stat(script)
+    os.utime(script, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert run(local.load("train.sh", parser)) == {"length": 4}
+    assert calls == ["abc", "abcd", "wxyz"]
+
+
+# S3Storage
+
+def test_s3_stat_missing_key_returns_none(s3):
+    assert run(s3.stat("train.sh")) is None
+    assert not run(s3.exists("train.sh"))
+
+
+def test_s3_stat_reraises_other_errors(s3):
+    class AccessDenied(Exception):
+        response = {"Error": {"Code": "AccessDenied"}}
+
+    def head_object(**kwargs):
+        raise AccessDenied()
+
+    s3.client.head_object = head_object
+    with pytest.raises(AccessDenied):
+        run(s3.stat("train.sh"))
+
+
+def test_s3_list_respects_prefix_and_delimiter(s3):
+    s3.client._put("runs/workspace/datasets/goal/a.png", b"a")
+    s3.client._put("runs/workspace/datasets/goal/a.txt", b"caption")
+    s3.client._put("runs/workspace/datasets/goal/nested/b.png", b"b")
+    s3.client._put("runs/workspace/datasets/goalkeeper.png", b"c")
+    s3.client._put("other/workspace/datasets/goal/d.png", b"d")
+
+    files = run(s3.list("workspace/datasets/goal"))
+
+    assert sorted((f.name, f.size) for f in files) == [("a.png", 1), ("a.txt", 7)]
+
+
+def test_s3_read_write_round_trip(s3):
+    run(s3.write_text("workspace/datasets/goal/a.txt", "a caption"))
+    run(s3.write_fileobj("workspace/datasets/goal/a.png", io.BytesIO(b"png")))
+
+    assert "runs/workspace/datasets/goal/a.txt" in s3.client.objects
+    assert run(s3.read_text("workspace/datasets/goal/a.txt")) == "a caption"
+    assert run(s3.read_bytes("workspace/datasets/goal/a.png")) == b"png"
+    assert run(s3.stat("workspace/datasets/goal/a.png")).size == 3
+
+
+def test_s3_response_streams_body(s3):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    run(s3.write_bytes("workspace/output/chroma_loras/lora.safetensors", data))
+
+    async def fetch():
+        response = await s3.response("workspace/output/chroma_loras/lora.safetensors", filename="lora.safetensors")
+        chunks = [chunk async for chunk in response.body_iterator]
+        return response, chunks
+
+    response, chunks = run(fetch())
+
+    assert len(chunks) > 1
+    assert b"".join(chunks) == data
+    assert response.headers["content-length"] == str(len(data))
+    assert 'filename="lora.safetensors"' in response.headers["content-disposition"]
+
+
+def test_s3_response_encodes_unsafe_filenames(s3):
+    run(s3.write_bytes("workspace/output/chroma_loras/x.safetensors", b"x"))
+
+    async def disposition(filename):
+        response = await s3.response("workspace/output/chroma_loras/x.safetensors", filename=filename)
+        return response.headers["content-disposition"]
+
+    assert run(disposition('my "best".safetensors')) == "attachment; filename*=utf-8''my%20%22best%22.safetensors"
+    assert run(disposition("lora_é猫.safetensors")) == "attachment; filename*=utf-8''lora_%C3%A9%E7%8C%AB.safetensors"
+
+
+# Sync between backends
+
+def test_sync_copies_new_and_changed_files_only(local, s3):
+    run(s3.write_bytes("workspace/datasets/goal/a.png", b"a"))
+    run(s3.write_bytes("workspace/datasets/goal/b.png", b"b"))
+
+    assert sorted(run(sync(s3, local, "workspace/datasets/goal"))) == ["a.png", "b.png"]
+    assert run(local.read_bytes("workspace/datasets/goal/b.png")) == b"b"
+    assert run(sync(s3, local, "workspace/datasets/goal")) == []
+
+    run(local.write_bytes("workspace/output/chroma_loras/lora.safetensors", b"weights"))
+    assert run(sync(local, s3, "workspace/output/chroma_loras")) == ["lora.safetensors"]
+    assert run(s3.read_bytes("workspace/output/chroma_loras/lora.safetensors")) == b"weights"